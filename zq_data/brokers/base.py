@@ -2,19 +2,60 @@
 Broker基类实现
 提供基础的配置加载和数据获取功能
 """
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
 import os
 from re import A
 from weakref import proxy
-import yaml
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import Callable, Dict, Optional
-import polars as pl
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple, Union
+from loguru import logger as log
 from ..core.asyncrequest import AsyncRest, AsyncWS
+from ..core.http import close_session
+
+if TYPE_CHECKING:
+    import polars as pl
+
+# K线周期单位对应的秒数, 月线长度不固定不在此列
+_FREQ_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MILLISECOND = timedelta(milliseconds=1)
+
+# 已解析的配置缓存, 绝对路径 -> (修改时间, 配置), 文件修改后替换
+_YAML_CACHE: Dict[str, Tuple[int, Dict]] = {}
+
+
+def to_ms(dt: Union[datetime, int]) -> int:
+    """
+    转换为毫秒时间戳, 无时区的时间按UTC处理
+    
+    Args:
+        dt: 时间或毫秒时间戳
+        
+    Returns:
+        毫秒时间戳
+    """
+    if isinstance(dt, int):
+        return dt
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // _MILLISECOND
+
+
+@functools.lru_cache(maxsize=None)
+def _default_config_path(cls: type) -> str:
+    """子类所在文件同名的yaml配置路径"""
+    subclass_file = inspect.getfile(cls)
+    return os.path.splitext(subclass_file)[0] + '.yaml'
 
 
 class BaseBroker(ABC):
-    """Broker基类"""
+    """Broker基类, 使用完毕后需调用close释放连接"""
     
     def __init__(self, config_path: Optional[str] = None):
         """
@@ -25,8 +66,12 @@ class BaseBroker(ABC):
         """
         super().__init__()
         self.config = self._load_config(config_path)
-        self.rest_client =AsyncRest(self.config["rest_host"],proxy=self.config["proxy"])
+        self.rest_client =AsyncRest(self.config["rest_host"],proxy=self.config["proxy"],
+                                    weight_limit=self.config.get("weight_limit"))
         self.ws_client = AsyncWS(self.config["ws_host"],proxy=self.config["proxy"])
+        # 数据流名称 -> 回调函数集合, 所有数据流复用同一个WebSocket连接
+        self.callbacks: Dict[str, Set[Callable]] = {}
+        self.ws_client.init(self.config["ws_host"], self._on_connected, self._on_message)
         
     def _load_config(self, config_path: Optional[str] = None) -> Dict:
         """
@@ -39,16 +84,35 @@ class BaseBroker(ABC):
             配置字典
         """
         if not config_path:
-            # 使用当前文件名对应的yaml配置
-            current_file = os.path.basename(__file__)
-            config_name = os.path.splitext(current_file)[0] + '.yaml'
-            config_path = os.path.join(os.path.dirname(__file__), config_name)
+            # 使用子类文件名对应的yaml配置
+            config_path = _default_config_path(type(self))
             
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"配置文件不存在: {config_path}")
             
+        key = os.path.abspath(config_path)
+        mtime = os.stat(config_path).st_mtime_ns
+        cached = _YAML_CACHE.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        
+        import yaml
+        # 优先使用libyaml的C实现
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
         with open(config_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+            config = yaml.load(f, Loader=loader)
+        _YAML_CACHE[key] = (mtime, config)
+        return config
+
+    async def close(self):
+        """
+        关闭WebSocket连接和HTTP会话, 程序退出前必须调用
+        
+        共享会话会一并关闭, 当前事件循环中的其他Broker下次请求时自动重建
+        """
+        await self.ws_client.close()
+        await self.rest_client.close()
+        await close_session()
     
 
 
@@ -71,6 +135,51 @@ class BaseBroker(ABC):
         # 子类实现具体的数据获取逻辑
         raise NotImplementedError
         
+    async def get_klines_range(self, symbol: str, freq: str,
+                               start_time: datetime, end_time: datetime,
+                               limit: int = 1000, concurrency: int = 10) -> pl.DataFrame:
+        """
+        获取大时间范围的K线数据
+        
+        按单次请求最多limit根K线切分时间窗口, 并发调用get_kline后合并结果
+        
+        Args:
+            symbol: 交易对
+            freq: K线周期
+            start_time: 开始时间
+            end_time: 结束时间
+            limit: 单次请求最大K线数量
+            concurrency: 最大并发请求数
+            
+        Returns:
+            K线数据DataFrame
+        """
+        unit = _FREQ_SECONDS.get(freq[-1:])
+        if unit is None or not freq[:-1].isdigit():
+            # 无法确定K线长度时不切分
+            return await self.get_kline(symbol, freq, start_time, end_time)
+        span = timedelta(seconds=int(freq[:-1]) * unit * limit)
+        
+        windows = []
+        window_start = start_time
+        while window_start <= end_time:
+            window_end = min(window_start + span - timedelta(milliseconds=1), end_time)
+            windows.append((window_start, window_end))
+            window_start += span
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def fetch(window_start: datetime, window_end: datetime) -> pl.DataFrame:
+            async with semaphore:
+                return await self.get_kline(symbol, freq, window_start, window_end)
+        
+        import polars as pl
+        dfs = await asyncio.gather(*(fetch(*window) for window in windows))
+        dfs = [df for df in dfs if not df.is_empty()]
+        if not dfs:
+            return pl.DataFrame()
+        return pl.concat(dfs, rechunk=True)
+        
     async def get_tick(self, symbol: str,
                       start_time: datetime, end_time: datetime) -> pl.DataFrame:
         """
@@ -93,7 +202,163 @@ class BaseBroker(ABC):
         
         Args:
             symbol: 交易对
-            callback: 数据回调函数
+            callback: 数据回调函数, 接收解析后的原始消息dict;
+                      需要DataFrame时可用batched包装
         """
         # 子类实现具体的订阅逻辑
         raise NotImplementedError
+
+    def _subscribe_message(self, streams: List[str]):
+        """
+        构造订阅消息
+        
+        Args:
+            streams: 数据流名称列表
+            
+        Returns:
+            发送给WebSocket服务器的订阅消息
+        """
+        # 子类实现具体的订阅消息格式
+        raise NotImplementedError
+
+    async def _subscribe_stream(self, stream: str, callback: Callable):
+        """
+        订阅数据流, 同一数据流只向服务器订阅一次
+        
+        Args:
+            stream: 数据流名称
+            callback: 数据回调函数
+        """
+        callbacks = self.callbacks.get(stream)
+        if callbacks is None:
+            callbacks = self.callbacks[stream] = set()
+            # 未连接或发送时恰好断开, 都会在连接建立后统一订阅
+            if self.ws_client.connected:
+                try:
+                    await self.ws_client.send(self._subscribe_message([stream]))
+                except ConnectionError:
+                    pass
+        callbacks.add(callback)
+
+    async def _on_connected(self):
+        """连接建立后一次性订阅全部数据流"""
+        if self.callbacks:
+            await self.ws_client.send(self._subscribe_message(list(self.callbacks)))
+
+    async def _on_message(self, data):
+        """
+        按数据流名称分发多路复用消息
+        
+        Args:
+            data: 消息, 格式为{"stream": 数据流名称, "data": 数据}
+        """
+        if not isinstance(data, dict):
+            return
+        callbacks = self.callbacks.get(data.get("stream"))
+        if not callbacks:
+            return
+        payload = data.get("data")
+        # 并发执行回调, 单个回调变慢或出错不影响其他订阅者
+        results = await asyncio.gather(
+            *(cb(payload) for cb in callbacks), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                log.opt(exception=result).error(f"Stream callback error: {result}")
+
+    @staticmethod
+    def batch(rows: List[Dict], schema: Dict) -> pl.DataFrame:
+        """
+        将一批原始消息转换为DataFrame
+        
+        Args:
+            rows: 原始消息列表
+            schema: DataFrame结构
+            
+        Returns:
+            DataFrame
+        """
+        import polars as pl
+        return pl.from_dicts(rows, schema=schema)
+
+    @staticmethod
+    def from_rows(rows: List[list], schema: Dict) -> pl.DataFrame:
+        """
+        将按行组织的数据(如REST接口返回的K线数组)转换为DataFrame
+        
+        先转置为按列组织的数据再构造, 跳过Polars的方向推断; 以字符串返回的价格、
+        数量等字段随后按schema一次性向量化转换
+        
+        Args:
+            rows: 按行组织的数据, 每行字段顺序与schema一致
+            schema: DataFrame结构
+            
+        Returns:
+            DataFrame
+        """
+        import polars as pl
+        if not rows:
+            return pl.DataFrame(schema=schema)
+        cols = list(zip(*rows))
+        return pl.DataFrame(dict(zip(schema, cols))).cast(schema)
+
+    def batched(self, callback: Callable, schema: Dict,
+                size: int = 500, interval: float = 1.0) -> Callable:
+        """
+        包装DataFrame回调, 使其可直接用于订阅接口
+        
+        消息先缓存, 累积size条或距首条消息interval秒后统一转换为DataFrame,
+        避免逐条消息构造DataFrame. 取消订阅或退出前需调用返回函数的flush(),
+        否则缓存中未满一批的消息会丢失
+        
+        Args:
+            callback: 接收DataFrame的回调函数
+            schema: DataFrame结构
+            size: 批量大小
+            interval: 最长缓存时间(秒)
+            
+        Returns:
+            接收原始消息的回调函数, 其flush属性用于立即刷新缓存
+        """
+        rows: List[Dict] = []
+        timer = None
+        # 定时刷新的任务需保留引用, 避免执行中被回收
+        pending: Set[asyncio.Task] = set()
+
+        async def flush():
+            nonlocal timer
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            if rows:
+                df = self.batch(rows, schema)
+                rows.clear()
+                await callback(df)
+
+        def on_flushed(task: asyncio.Task):
+            pending.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                error = task.exception()
+                log.opt(exception=error).error(f"Batch callback error: {error}")
+
+        def on_timer():
+            task = asyncio.ensure_future(flush())
+            pending.add(task)
+            task.add_done_callback(on_flushed)
+
+        async def on_data(data: Dict):
+            nonlocal timer
+            rows.append(data)
+            if len(rows) >= size:
+                await flush()
+            elif timer is None:
+                timer = asyncio.get_running_loop().call_later(interval, on_timer)
+
+        async def drain():
+            # 刷新剩余消息, 并等待正在执行的定时刷新完成
+            await flush()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        on_data.flush = drain
+        return on_data
@@ -2,15 +2,30 @@
 数据采集器基类
 """
 import asyncio
+import functools
+import random
+import time
 from abc import ABC, abstractmethod
-import json
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
+from urllib.parse import urlencode
 from weakref import proxy
 import aiohttp
+import orjson
 from aiohttp import ClientResponse, ClientSession, ClientTimeout, WSMsgType
 from aiohttp.client_exceptions import ServerDisconnectedError
 import traceback
 from loguru import logger as log
+from .http import get_session
+
+
+@functools.lru_cache(maxsize=1024)
+def _url_prefix(base: str, fixed: Tuple[Tuple[str, Any], ...]) -> str:
+    """拼接并编码不变的查询参数"""
+    if not fixed:
+        return base
+    separator = "&" if "?" in base else "?"
+    return f"{base}{separator}{urlencode(fixed)}"
+
 
 class AsyncRest(ABC):
     """REST API采集器基类"""
@@ -22,37 +37,87 @@ class AsyncRest(ABC):
         max_retries: int = 3,
         retry_delay: float = 1.0,
         timeout: float = 30,
-        proxy=None
+        proxy=None,
+        weight_limit: Optional[int] = None,
+        weight_header: str = "X-MBX-USED-WEIGHT-1M"
     ):
         """
         初始化REST采集器
         
         Args:
-            session: aiohttp会话，如果不提供则创建新的
+            host: 服务地址, 请求相对路径时拼接在前
+            session: aiohttp会话，如果不提供则使用共享会话
             max_retries: 最大重试次数
             retry_delay: 重试基础延迟时间(秒)
             timeout: 请求超时时间(秒)
+            proxy: 代理地址
+            weight_limit: 每分钟请求权重上限, 不提供则不限制
+            weight_header: 返回已用权重的响应头
         """
-        self.session = session or ClientSession(
-            timeout=ClientTimeout(total=timeout)
-        )
+        self.host = host.rstrip("/")
+        self.proxy = proxy
+        self.session = session
+        self.timeout = ClientTimeout(total=timeout)
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.weight_limit = weight_limit
+        self.weight_header = weight_header
+        self.used_weight = 0
+        self._resume_at = 0.0  # 权重接近上限时恢复请求的时间戳, 所有请求共享
     
     async def check_rate_limit(self) :
         """
         检查频率限制，返回需要等待的时间（秒）
         
+        已用权重接近上限时, 所有请求都等待到下一分钟权重重置
+        
         Returns:
             float: 需要等待的时间，0表示可以立即请求
         """
-        return 0
+        return max(0.0, self._resume_at - time.time())
+    
+    def _update_rate_limit(self, response: ClientResponse):
+        """根据响应头更新已用权重, 接近上限时设置恢复请求的时间"""
+        weight = response.headers.get(self.weight_header)
+        if weight is None:
+            return
+        try:
+            self.used_weight = int(weight)
+        except ValueError:
+            return
+        if self.weight_limit and self.used_weight >= self.weight_limit * 0.9:
+            # 权重按分钟重置, 恢复时间只由最新的响应头决定
+            now = time.time()
+            self._resume_at = now - now % 60 + 60
+    
+    def build_url(self, path: str, fixed: Tuple[Tuple[str, Any], ...] = (), **params) -> str:
+        """
+        构造带查询参数的请求URL
+        
+        不变参数(如交易对、周期)的编码结果按(path, fixed)缓存, 轮询时只拼接变化的参数,
+        避免每次请求构造参数字典并重新编码
+        
+        Args:
+            path: 请求路径, 以/开头时视为相对host的路径
+            fixed: 不变的查询参数, 如(("symbol", "BTCUSDT"), ("interval", "1m"))
+            **params: 每次变化的查询参数(如时间戳), 值需已完成URL编码
+        
+        Returns:
+            请求URL
+        """
+        if path.startswith("/"):
+            path = self.host + path
+        url = _url_prefix(path, fixed)
+        if not params:
+            return url
+        query = "&".join(f"{key}={value}" for key, value in params.items())
+        separator = "&" if "?" in url else "?"
+        return f"{url}{separator}{query}"
     
     async def _retry_request(
         self,
         method: str,
         url: str,
-        retry_count: int = 0,
         **kwargs
     ) -> ClientResponse:
         """
@@ -60,42 +125,62 @@ class AsyncRest(ABC):
         
         Args:
             method: 请求方法
-            url: 请求URL
-            retry_count: 当前重试次数
+            url: 请求URL, 以/开头时视为相对host的路径
             **kwargs: 请求参数
             
         Returns:
             响应对象
             
         Raises:
-            aiohttp.ClientError: 重试次数用完后仍然失败
+            aiohttp.ClientError: 重试次数用完后仍然失败, 或返回不可重试的4xx状态码
+            asyncio.TimeoutError: 重试次数用完后仍然超时
         """
-        try:
+        session = self.session or await get_session()
+        if url.startswith("/"):
+            url = self.host + url
+        kwargs.setdefault("timeout", self.timeout)
+        if self.proxy:
+            kwargs.setdefault("proxy", self.proxy)
+        for attempt in range(self.max_retries + 1):
             # 检查频率限制
             wait_time = await self.check_rate_limit()
             if wait_time > 0:
                 await asyncio.sleep(wait_time)
             
+            # 指数退避并加入随机抖动, 避免重试请求集中爆发
+            delay = self.retry_delay * (2 ** attempt) + random.uniform(0, self.retry_delay)
+            retryable = attempt < self.max_retries
+            
             # 发送请求
-            response = await self.session.request(method, url, **kwargs)
-            response.raise_for_status()
-            return response
+            try:
+                response = await session.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if not retryable:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            
+            self._update_rate_limit(response)
+            if response.status < 400:
+                return response
             
-        except aiohttp.ClientError as e:
-            # 如果还有重试次数
-            if retry_count < self.max_retries:
-                # 计算延迟时间：基础延迟 * (2^重试次数)
-                delay = self.retry_delay * (2 ** retry_count)
+            if retryable and response.status in (418, 429):
+                # 被限频时按服务端要求的时间等待
+                try:
+                    delay = float(response.headers.get("Retry-After", delay))
+                except ValueError:
+                    pass
+                log.warning(f"Rate limited ({response.status}), retrying in {delay:.1f}s: {url}")
+                response.release()
                 await asyncio.sleep(delay)
-                
-                # 递归重试
-                return await self._retry_request(
-                    method,
-                    url,
-                    retry_count + 1,
-                    **kwargs
-                )
-            raise e
+                continue
+            if retryable and response.status >= 500:
+                response.release()
+                await asyncio.sleep(delay)
+                continue
+            
+            # 其余4xx不重试
+            response.raise_for_status()
     
     async def get(self, url: str, **kwargs) -> Any:
         """
@@ -125,18 +210,23 @@ class AsyncRest(ABC):
             return await response.json()
     
     async def close(self):
-        """关闭会话"""
+        """关闭会话, 共享会话由core.http统一关闭"""
         if self.session and not self.session.closed:
             await self.session.close()
 
 
 class AsyncWS(ABC):
     """WebSocket采集器基类"""
-    def __init__(self, url: str,proxy=None):
+    def __init__(self, url: str,proxy=None, reconnect_delay: float = 1.0,
+                 max_reconnect_delay: float = 30.0):
         self.proxy = proxy
         self.url = url
         self._ws = None  # Websocket connection object.
         self.session = None
+        self._closing = False
+        self._running = False  # 连接循环是否已在运行, 保证只有一个循环
+        self.reconnect_delay = reconnect_delay  # 重连基础延迟时间(秒)
+        self.max_reconnect_delay = max_reconnect_delay  # 重连最大延迟时间(秒)
             
     def init(self, url, connected_callback, process_callback=None, process_binary_callback=None):
         self.url = url
@@ -144,76 +234,128 @@ class AsyncWS(ABC):
         self.process_binary_callback = process_binary_callback
         self.process_callback = process_callback
 
+    @property
+    def connected(self) -> bool:
+        """WebSocket 是否已连接"""
+        return self._ws is not None and not self._ws.closed
+
     async def conn(self):
+        self._closing = False
         await self._connect()
 
     async def _connect(self):
-        """连接到 WebSocket 服务器"""
-        self.session = aiohttp.ClientSession()
+        """连接到 WebSocket 服务器, 断开后按指数退避自动重连, 直到调用close"""
+        if self._running:
+            log.warning("WebSocket connection loop already running")
+            return
+        self._running = True
         try:
-            if self.proxy:
-                self._ws = await self.session.ws_connect(self.url, proxy=self.proxy)
-            else:
-                self._ws = await self.session.ws_connect(self.url)
-            log.debug("WebSocket connected successfully")
-            
-            if hasattr(self, 'connected_callback'):
-                await self.connected_callback()
-                log.debug("WebSocket connected callback executed")
-            
-            await self._receive()
-        except Exception as e:
-            log.error(f"WebSocket connection error: {str(e)}")
-            traceback.print_exc()
-            await asyncio.sleep(1)  # 添加重连延迟
-            await self._check_connection()
+            await self._connect_loop()
         finally:
-            if hasattr(self, 'session'):
-                await self.session.close()
+            self._running = False
+
+    async def _connect_loop(self):
+        attempt = 0
+        while not self._closing:
+            # 每次连接都重新获取, 保证会话属于当前事件循环
+            self.session = await get_session()
+            try:
+                # compress=15 启用permessage-deflate压缩
+                if self.proxy:
+                    self._ws = await self.session.ws_connect(self.url, proxy=self.proxy, compress=15)
+                else:
+                    self._ws = await self.session.ws_connect(self.url, compress=15)
+                # 建立连接期间调用了close, 新连接不再使用
+                if self._closing:
+                    await self._ws.close()
+                    break
+                log.debug("WebSocket connected successfully")
+                connected_at = time.monotonic()
+                
+                # 连接回调负责重新订阅
+                if hasattr(self, 'connected_callback'):
+                    await self.connected_callback()
+                    log.debug("WebSocket connected callback executed")
+                
+                await self._receive()
+                log.warning("WebSocket connection closed")
+                # 连接保持超过最大重连延迟才视为稳定, 避免连上即断时退避不增长
+                if time.monotonic() - connected_at >= self.max_reconnect_delay:
+                    attempt = 0
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                log.warning(f"WebSocket connection error: {e!r}")
+            except Exception as e:
+                log.error(f"WebSocket error: {str(e)}")
+                traceback.print_exc()
+            
+            if self._closing:
+                break
+            delay = min(self.max_reconnect_delay, self.reconnect_delay * (2 ** attempt))
+            attempt += 1
+            log.info(f"Reconnecting to WebSocket server in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
     async def _receive(self):
-        """接收 WebSocket 消息"""
-        async for msg in self._ws:
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                if self.process_callback:
-                    try:
-                        data = json.loads(msg.data)
-                    except json.JSONDecodeError:
-                        data = msg.data
-                    await self.process_callback(data)
-            elif msg.type == aiohttp.WSMsgType.BINARY:
-                if self.process_binary_callback:
-                    await self.process_binary_callback(msg.data)
-            elif msg.type == aiohttp.WSMsgType.CLOSED:
-                log.warning(f"WebSocket connection closed: {msg}")
-                await self._reconnect()
-            elif msg.type == aiohttp.WSMsgType.PING:
-                log.debug(f"Received PING: {msg.data}")
-                await self._ws.pong(msg.data)
-            elif msg.type == aiohttp.WSMsgType.ERROR:
-                log.error(f"WebSocket error occurred: {msg}")
+        """接收 WebSocket 消息, 回调在每次连接建立时绑定"""
+        # 热路径使用局部变量, 避免每条消息重复查找属性
+        ws = self._ws
+        dispatch = AsyncWS._DISPATCH
+        on_unknown = AsyncWS._on_unknown
+        text = WSMsgType.TEXT
+        loads = AsyncWS._loads
+        callback = self.process_callback
+        async for msg in ws:
+            msg_type = msg.type
+            if msg_type is text:
+                if callback:
+                    await callback(loads(msg.data))
             else:
-                log.warning(f"Unhandled WebSocket message type: {msg}")
-
-    async def _check_connection(self):
-        """检查 WebSocket 连接状态，如果断开则重连"""
-        if not self._ws:
-            log.warning("WebSocket connection not established")
-            await asyncio.sleep(1)  # 添加重连延迟
-            await self._connect()
-            return
-            
-        if self._ws.closed:
-            log.warning("WebSocket connection closed, attempting to reconnect")
-            await asyncio.sleep(1)  # 添加重连延迟
-            await self._reconnect()
+                await dispatch.get(msg_type, on_unknown)(self, msg)
+
+    @staticmethod
+    def _loads(data):
+        """解析JSON消息, 解析失败时返回原始数据; orjson可直接解析bytes"""
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return data
+
+    async def _on_binary(self, msg):
+        if self.process_binary_callback:
+            await self.process_binary_callback(msg.data)
+        elif self.process_callback:
+            # 未设置二进制回调时按JSON处理
+            await self.process_callback(self._loads(msg.data))
+
+    async def _on_ping(self, msg):
+        log.debug(f"Received PING: {msg.data}")
+        await self._ws.pong(msg.data)
+
+    async def _on_error(self, msg):
+        log.error(f"WebSocket error occurred: {msg}")
+
+    async def _on_unknown(self, msg):
+        log.warning(f"Unhandled WebSocket message type: {msg}")
+
+    # 消息类型 -> 处理函数
+    # TEXT在_receive中直接处理; CLOSE/CLOSING/CLOSED会结束aiohttp的消息迭代,
+    # 由_connect负责重连; PING仅在关闭autoping时才会出现
+    _DISPATCH = {
+        WSMsgType.BINARY: _on_binary,
+        WSMsgType.PING: _on_ping,
+        WSMsgType.ERROR: _on_error,
+    }
 
     async def _reconnect(self):
-        """重新连接到 WebSocket 服务器"""
-        log.info("Reconnecting to WebSocket server")
+        """断开当前连接, 由_connect负责重连"""
+        if self._ws and not self._ws.closed:
+            await self._ws.close()
+
+    async def close(self):
+        """关闭 WebSocket 连接, 之后不再自动重连; 共享会话由core.http统一关闭"""
+        self._closing = True
         if self._ws and not self._ws.closed:
             await self._ws.close()
-        await self._connect()
 
     async def send(self, data):
         """发送数据到 WebSocket 服务器
@@ -222,18 +364,15 @@ class AsyncWS(ABC):
             data: 要发送的数据
             
         Raises:
-            ConnectionError: WebSocket 未连接时抛出
+            ConnectionError: WebSocket 未连接时抛出, 连接由conn启动的循环负责建立
         """
-        if not self._ws or self._ws.closed:
-            log.warning("WebSocket not connected, attempting to connect")
-            await self._connect()
+        ws = self._ws
+        if ws is None or ws.closed:
+            raise ConnectionError("WebSocket not connected")
             
-        if self._ws and not self._ws.closed:
-            if isinstance(data, (dict, list)):
-                await self._ws.send_json(data)
-            elif isinstance(data, str):
-                await self._ws.send_str(data)
-            else:
-                await self._ws.send_bytes(data)
+        if isinstance(data, (dict, list)):
+            await ws.send_str(orjson.dumps(data).decode())
+        elif isinstance(data, str):
+            await ws.send_str(data)
         else:
-            raise ConnectionError("Failed to establish WebSocket connection")
+            await ws.send_bytes(data)
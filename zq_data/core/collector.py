@@ -1,11 +1,14 @@
 """
 数据采集器基类
 """
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
-from typing import Callable, Optional
+from typing import TYPE_CHECKING, Callable, Optional
 from datetime import datetime
 
-import polars as pl
+if TYPE_CHECKING:
+    import polars as pl
 
 
 class BaseCollector(ABC):
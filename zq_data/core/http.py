@@ -0,0 +1,38 @@
+"""
+共享HTTP会话
+所有REST/WebSocket客户端复用同一个连接池, 避免重复的TLS握手和DNS解析
+"""
+import asyncio
+from weakref import WeakKeyDictionary
+
+from aiohttp import ClientSession, TCPConnector
+
+# 会话绑定创建它的事件循环, 每个事件循环各自持有一个共享会话
+_sessions: "WeakKeyDictionary[asyncio.AbstractEventLoop, ClientSession]" = WeakKeyDictionary()
+
+
+async def get_session() -> ClientSession:
+    """
+    获取当前事件循环的共享aiohttp会话, 首次调用时创建
+
+    Returns:
+        共享会话
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = TCPConnector(
+            limit=100,
+            limit_per_host=30,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+        )
+        session = _sessions[loop] = ClientSession(connector=connector)
+    return session
+
+
+async def close_session():
+    """关闭当前事件循环的共享会话, 仅在程序退出时调用"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
@@ -1,11 +1,14 @@
 """
 数据服务
 """
+from __future__ import annotations
+
 from datetime import datetime
 from pathlib import Path
-from typing import Callable, Dict, Optional, Union
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Union
 
-import polars as pl
+if TYPE_CHECKING:
+    import polars as pl
 
 from zq_data.core.collector import BaseCollector
 from zq_data.core.storage import Storage
@@ -30,6 +33,7 @@ class ZQData:
             return await self.collectors[collector].get_kline(
                 symbol, freq, start_time, end_time
             )
+        import polars as pl
         return pl.DataFrame()
     
     async def get_tick(self, symbol: str, 
@@ -40,6 +44,7 @@ class ZQData:
             return await self.collectors[collector].get_tick(
                 symbol, start_time, end_time
             )
+        import polars as pl
         return pl.DataFrame()
     
     async def subscribe_tick(self, symbol: str, callback: Callable,
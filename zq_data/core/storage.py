@@ -1,11 +1,14 @@
 """
 数据存储管理
 """
+from __future__ import annotations
+
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Union
+from typing import TYPE_CHECKING, List, Optional, Union
 
-import polars as pl
+if TYPE_CHECKING:
+    import polars as pl
 
 
 class Storage:
@@ -27,10 +30,19 @@ class Storage:
     async def save_data(self, df: pl.DataFrame, path: Path):
         """保存数据"""
         path.parent.mkdir(parents=True, exist_ok=True)
-        df.write_parquet(path)
+        # zstd压缩重复的品种字段效果明显, 行组统计信息便于读取时跳过无关行组
+        df.write_parquet(
+            path,
+            compression="zstd",
+            compression_level=3,
+            statistics=True,
+            row_group_size=65536,
+            use_pyarrow=False,
+        )
         
-    async def load_data(self, path: Path) -> pl.DataFrame:
-        """加载数据"""
+    async def load_data(self, path: Path, columns: Optional[List[str]] = None) -> pl.DataFrame:
+        """加载数据, columns指定时只读取对应列"""
+        import polars as pl
         if not path.exists():
             return pl.DataFrame()
-        return pl.read_parquet(path)
+        return pl.read_parquet(path, columns=columns, use_statistics=True, low_memory=False)